@@ -1,7 +1,14 @@
 import os
 import re
 import hashlib
+import json
+import logging
 import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import requests
@@ -29,6 +36,26 @@ st.set_page_config(
 DO_AGENT_ENDPOINT = st.secrets.get("DO_AGENT_ENDPOINT", os.getenv("DO_AGENT_ENDPOINT", "")).rstrip("/")
 DO_AGENT_API_KEY = st.secrets.get("DO_AGENT_API_KEY", os.getenv("DO_AGENT_API_KEY", ""))
 AGENT_ID = st.secrets.get("AGENT_ID", os.getenv("AGENT_ID", ""))  # optional / parity
+# Global cap on in-flight agent calls (shared by every session + comparison fan-out)
+AGENT_MAX_CONCURRENCY = int(st.secrets.get("AGENT_MAX_CONCURRENCY", os.getenv("AGENT_MAX_CONCURRENCY", "4")))
+DASHBOARD_CACHE_TTL_S = int(st.secrets.get("DASHBOARD_CACHE_TTL_S", os.getenv("DASHBOARD_CACHE_TTL_S", "900")))
+# Shared server-side conversation store (session state only keeps a session_id handle)
+IATI_STORE_PATH = st.secrets.get("IATI_STORE_PATH", os.getenv("IATI_STORE_PATH", ".iati_sessions.sqlite3"))
+SESSION_IDLE_TTL_S = int(st.secrets.get("SESSION_IDLE_TTL_S", os.getenv("SESSION_IDLE_TTL_S", "7200")))
+CHAT_RENDER_WINDOW = int(st.secrets.get("CHAT_RENDER_WINDOW", os.getenv("CHAT_RENDER_WINDOW", "20")))
+# Max narrow follow-up calls used to re-fetch only the dashboard tables that failed to parse
+DASHBOARD_REPAIR_BUDGET = int(st.secrets.get("DASHBOARD_REPAIR_BUDGET", os.getenv("DASHBOARD_REPAIR_BUDGET", "2")))
+# Multi-turn chat: total token budget per request, and the share reserved for the compacted summary
+CONTEXT_TOKEN_BUDGET = int(st.secrets.get("CONTEXT_TOKEN_BUDGET", os.getenv("CONTEXT_TOKEN_BUDGET", "3000")))
+SUMMARY_TOKEN_BUDGET = int(st.secrets.get("SUMMARY_TOKEN_BUDGET", os.getenv("SUMMARY_TOKEN_BUDGET", "600")))
+LOG_LEVEL = st.secrets.get("LOG_LEVEL", os.getenv("LOG_LEVEL", "INFO"))
+
+logger = logging.getLogger("iati_agent")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
 
 if not DO_AGENT_ENDPOINT:
     st.error("Missing DO_AGENT_ENDPOINT. Add it in Streamlit Secrets or environment variables.")
@@ -180,23 +207,162 @@ st.markdown(
 # Helpers
 # ============================================================
 
-def call_agent_api(message: str) -> str:
-    """Calls DO agent endpoint and returns formatted text."""
+@st.cache_resource
+def agent_rate_limiter() -> threading.BoundedSemaphore:
+    """Process-wide semaphore so concurrent sessions/fan-outs respect AGENT_MAX_CONCURRENCY."""
+    return threading.BoundedSemaphore(max(AGENT_MAX_CONCURRENCY, 1))
+
+@st.cache_resource
+def dashboard_slice_cache() -> dict:
+    """Server-side cache of KB dashboard markdown keyed by context string."""
+    return {"lock": threading.Lock(), "slices": {}}
+
+class ConversationStore:
+    """
+    SQLite-backed store for chat history and per-session dashboard state.
+    One connection shared across sessions (serialized by a lock); rows are keyed by session_id.
+    """
+
+    EVICT_EVERY_S = 60
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " session_id TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_messages_session ON messages (session_id, id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " session_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (session_id, key))"
+            )
+
+    def touch(self, session_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, last_seen) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen",
+                (session_id, time.time()),
+            )
+
+    def evict_idle(self, ttl_s: int) -> int:
+        """Drops sessions idle for longer than ttl_s (throttled to once per EVICT_EVERY_S)."""
+        now = time.time()
+        if now - self._last_evict < self.EVICT_EVERY_S:
+            return 0
+        self._last_evict = now
+        cutoff = now - ttl_s
+        with self._lock, self._conn:
+            stale = [r[0] for r in self._conn.execute("SELECT session_id FROM sessions WHERE last_seen < ?", (cutoff,))]
+            for table in ("messages", "kv", "sessions"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE session_id = ?", [(sid,) for sid in stale])
+        return len(stale)
+
+    def append_message(self, session_id: str, role: str, content: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", (session_id, role, content)
+            )
+
+    def message_count(self, session_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+        return int(row[0])
+
+    def recent_messages(self, session_id: str, limit: int) -> list[dict]:
+        """Most recent `limit` messages, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def messages_range(self, session_id: str, start: int, stop: int) -> list[dict]:
+        """Messages at positions [start, stop) in session order."""
+        if stop <= start:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id LIMIT ? OFFSET ?",
+                (session_id, stop - start, start),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def get_value(self, session_id: str, key: str, default: str = "") -> str:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE session_id = ? AND key = ?", (session_id, key)
+            ).fetchone()
+        return row[0] if row else default
+
+    def set_value(self, session_id: str, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO kv (session_id, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id, key) DO UPDATE SET value = excluded.value",
+                (session_id, key, value),
+            )
+
+    def session_bytes(self, session_id: str) -> int:
+        """Approximate stored payload size (UTF-8 bytes) for one session."""
+        with self._lock:
+            msg = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM messages WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()[0]
+            kv = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM kv WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()[0]
+        return int(msg) + int(kv)
+
+@st.cache_resource
+def conversation_store() -> ConversationStore:
+    return ConversationStore(IATI_STORE_PATH)
+
+# Resolved on the script thread; worker threads must not touch st.* caches.
+AGENT_LIMITER = agent_rate_limiter()
+SLICE_CACHE = dashboard_slice_cache()
+STORE = conversation_store()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token); good enough for budgeting, not billing."""
+    return max(1, len(text) // 4)
+
+def call_agent_api(message: str, history: list[dict] | None = None) -> str:
+    """Calls DO agent endpoint and returns formatted text. `history` is prepended for multi-turn chat."""
     if not DO_AGENT_API_KEY:
         return "Missing DO_AGENT_API_KEY. Add it in Streamlit Secrets to enable backend calls."
 
     url = f"{DO_AGENT_ENDPOINT}/api/v1/chat/completions"
     payload = {
-        "messages": [{"role": "user", "content": message}],
+        "messages": (history or []) + [{"role": "user", "content": message}],
         "stream": False,
         "include_functions_info": True,
         "include_retrieval_info": True,
         "include_guardrails_info": True,
     }
     headers = {"Content-Type": "application/json", "Authorization": f"Bearer {DO_AGENT_API_KEY}"}
+    logger.info(
+        "agent request: %d messages, %d payload bytes, ~%d tokens",
+        len(payload["messages"]),
+        len(json.dumps(payload).encode("utf-8")),
+        sum(estimate_tokens(m["content"]) for m in payload["messages"]),
+    )
 
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=80)
+        with AGENT_LIMITER:
+            r = requests.post(url, headers=headers, json=payload, timeout=80)
     except Exception as e:
         return f"Network error calling agent endpoint: {e}"
 
@@ -258,16 +424,15 @@ def money_to_float(x: str) -> float | None:
     s = str(x).strip()
     if not s or s.upper() in {"NA", "N/A", "NONE", "NULL", "-"}:
         return None
-    s = re.sub(r"[\$,]", "", s)
-    mult = 1.0
-    if re.search(r"[bB]\b", s):
-        mult = 1e9
-        s = re.sub(r"[bB]\b", "", s).strip()
-    elif re.search(r"[mM]\b", s):
-        mult = 1e6
-        s = re.sub(r"[mM]\b", "", s).strip()
+    # Accepts "$1.2B", "1,200,000,000 USD", "USD 1.2B", "US$ 350 million", "1.2 bn"
+    s = re.sub(r"(?i)\bUS\$|\bUSD\b|[\$,]", "", s).strip()
+    m = re.fullmatch(r"(?i)([-+]?\d*\.?\d+)\s*(b|bn|billion|m|mn|million)?", s)
+    if not m:
+        return None
+    unit = (m.group(2) or "").lower()
+    mult = 1e9 if unit.startswith("b") else 1e6 if unit.startswith("m") else 1.0
     try:
-        return float(s) * mult
+        return float(m.group(1)) * mult
     except:
         return None
 
@@ -347,13 +512,14 @@ def make_demo_type_heatmap_df(country: str, years: str, sector: str) -> pd.DataF
             rows.append({"Row": t, "Column": p, "Intensity": val})
     return pd.DataFrame(rows)
 
-def render_heatmap(df: pd.DataFrame, title: str, row_title: str):
+def render_heatmap(df: pd.DataFrame, title: str, row_title: str, col_title: str | None = None):
     """
     Standard risk-style heatmap:
     Low  = Green
     Medium = Yellow
     High = Red
     Includes legend.
+    col_title overrides the x-axis/tooltip label (defaults suit Row × Period grids).
     """
 
     # Risk color ramp (Low → Medium → High)
@@ -369,7 +535,7 @@ def render_heatmap(df: pd.DataFrame, title: str, row_title: str):
         alt.Chart(df)
         .mark_rect(stroke="white", strokeWidth=1)
         .encode(
-            x=alt.X("Column:N", title="Likelihood", axis=alt.Axis(labelAngle=90)),
+            x=alt.X("Column:N", title=col_title or "Likelihood", axis=alt.Axis(labelAngle=90)),
             y=alt.Y("Row:N", title=row_title),
             color=alt.Color(
                 "Intensity:Q",
@@ -383,7 +549,7 @@ def render_heatmap(df: pd.DataFrame, title: str, row_title: str):
             ),
             tooltip=[
                 alt.Tooltip("Row:N", title=row_title),
-                alt.Tooltip("Column:N", title="Period"),
+                alt.Tooltip("Column:N", title=col_title or "Period"),
                 alt.Tooltip("Intensity:Q", format=".1f"),
             ],
         )
@@ -397,6 +563,27 @@ def render_heatmap(df: pd.DataFrame, title: str, row_title: str):
 
 
 # ---- KB dashboard prompt spec (formatted markdown only; tables for charts) ----
+DASHBOARD_TABLES = {
+    "KPI": """| Metric | Value |
+|---|---|
+| Total commitments | <number USD> |
+| Total disbursements | <number USD> |
+| # projects | <integer> |
+| Disbursement ratio | <percent> |""",
+    "Trend": """| Period | Commitments | Disbursements |
+|---|---:|---:|
+| 2023 Q1 | ... | ... |""",
+    "Sectors": """| Sector | Value |
+|---|---:|
+| Health | ... |""",
+    "Mix": """| Type | Value |
+|---|---:|
+| Grants | ... |""",
+}
+DASHBOARD_SECTIONS = tuple(DASHBOARD_TABLES)
+NA_TOKENS = {"NA", "N/A", "NONE", "NULL"}
+BLANK_TOKENS = {"", "-"}
+
 def dashboard_prompt(context: str) -> str:
     return f"""
 You are the World Bank IATI Intelligence Agent.
@@ -409,27 +596,16 @@ Return **formatted markdown only** (no JSON) in this exact structure:
 (5–10 bullets, executive-friendly. Mention time window and scope.)
 
 ### KPI
-| Metric | Value |
-|---|---|
-| Total commitments | <number USD> |
-| Total disbursements | <number USD> |
-| # projects | <integer> |
-| Disbursement ratio | <percent> |
+{DASHBOARD_TABLES["KPI"]}
 
 ### Trend
-| Period | Commitments | Disbursements |
-|---|---:|---:|
-| 2023 Q1 | ... | ... |
+{DASHBOARD_TABLES["Trend"]}
 
 ### Sectors
-| Sector | Value |
-|---|---:|
-| Health | ... |
+{DASHBOARD_TABLES["Sectors"]}
 
 ### Mix
-| Type | Value |
-|---|---:|
-| Grants | ... |
+{DASHBOARD_TABLES["Mix"]}
 
 ### Evidence
 (Up to 6 items. Prefer IATI activity identifiers + short titles. If unavailable, say so clearly.)
@@ -437,28 +613,32 @@ Return **formatted markdown only** (no JSON) in this exact structure:
 If the KB does not contain enough data to fill tables, explicitly write 'NA' in the Value cells.
 """
 
-def build_dashboard_from_md(md: str):
-    kpi_df = parse_markdown_table(md, "KPI")
-    trend_df = parse_markdown_table(md, "Trend")
-    sectors_df = parse_markdown_table(md, "Sectors")
-    mix_df = parse_markdown_table(md, "Mix")
+def section_repair_prompt(context: str, sections: list[str]) -> str:
+    """Narrow follow-up asking only for the tables that failed to parse."""
+    tables = "\n\n".join(f"### {name}\n{DASHBOARD_TABLES[name]}" for name in sections)
+    return f"""
+You are the World Bank IATI Intelligence Agent.
 
-    def df_has_na(df: pd.DataFrame | None) -> bool:
-        if df is None or df.empty:
-            return True
-        flat = " ".join(df.astype(str).fillna("").values.flatten().tolist()).upper()
-        return "NA" in flat or "N/A" in flat
+{context}
 
-    missing = df_has_na(kpi_df) or df_has_na(trend_df) or df_has_na(sectors_df) or df_has_na(mix_df)
-    if missing:
-        return None
+A previous dashboard answer was missing usable data for: {", ".join(sections)}.
+Return **only** these markdown tables (no narrative, no JSON), each under its exact heading:
+
+{tables}
+
+Fill every cell with a concrete value from the KB. Use 'NA' only if the KB truly has no data.
+Format USD amounts like `$1.2B` or `$350M`, project counts as plain integers (`42`) and ratios like `65.0%`.
+"""
 
+def parse_kpi_map(kpi_df: pd.DataFrame) -> dict:
     kpi_map = {}
     for _, row in kpi_df.iterrows():
         metric = str(row.get("Metric", "")).strip()
         val = str(row.get("Value", "")).strip()
         ml = metric.lower()
-        if "commit" in ml:
+        if "ratio" in ml:
+            kpi_map["Disbursement Ratio %"] = pct_to_float(val)
+        elif "commit" in ml:
             kpi_map["Commitments"] = money_to_float(val)
         elif "disburs" in ml:
             kpi_map["Disbursements"] = money_to_float(val)
@@ -467,8 +647,107 @@ def build_dashboard_from_md(md: str):
                 kpi_map["Projects"] = int(re.sub(r"[^\d]", "", val) or "0")
             except:
                 kpi_map["Projects"] = None
-        elif "ratio" in ml:
-            kpi_map["Disbursement Ratio %"] = pct_to_float(val)
+    return kpi_map
+
+def section_failed(name: str, df: pd.DataFrame | None, strict: bool = True) -> bool:
+    """
+    True if a dashboard table is absent, lacks its columns or has explicit NA cells.
+    strict also fails blank cells and values that don't convert — used to pick what to repair,
+    while rendering (strict=False) tolerates them and shows "—" as before.
+    """
+    if df is None or df.empty:
+        return True
+    df = df.rename(columns={c: c.strip() for c in df.columns})
+    bad = NA_TOKENS | BLANK_TOKENS if strict else NA_TOKENS
+    if any(str(v).strip().upper() in bad for v in df.values.flatten().tolist()):
+        return True
+
+    if name == "KPI":
+        if not {"Metric", "Value"}.issubset(set(df.columns)):
+            return True
+        if not strict:
+            return False
+        kpi_map = parse_kpi_map(df)
+        keys = ("Commitments", "Disbursements", "Projects", "Disbursement Ratio %")
+        return any(kpi_map.get(k) is None for k in keys)
+
+    label, numeric = {
+        "Trend": ("Period", ["Commitments", "Disbursements"]),
+        "Sectors": ("Sector", ["Value"]),
+        "Mix": ("Type", ["Value"]),
+    }[name]
+    if not {label, *numeric}.issubset(set(df.columns)):
+        return True
+    return strict and any(money_to_float(v) is None for col in numeric for v in df[col])
+
+def dashboard_section_failures(md: str, strict: bool = True) -> list[str]:
+    return [name for name in DASHBOARD_SECTIONS if section_failed(name, parse_markdown_table(md, name), strict)]
+
+def section_span(md: str, header: str) -> tuple[int, int] | None:
+    """
+    (start, end) of a '### header' line plus the table that follows it. If no table precedes
+    the next heading, the span runs up to that heading so placeholder text goes too.
+    """
+    pattern = re.compile(rf"^###\s*{re.escape(header)}\s*$", re.IGNORECASE | re.MULTILINE)
+    m = pattern.search(md)
+    if not m:
+        return None
+    end = m.end()
+    pos = m.end()
+    in_table = False
+    for line in md[m.end():].splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith("|"):
+            in_table = True
+            end = pos + len(line.rstrip("\r\n"))
+        elif in_table or stripped.startswith("#"):
+            break
+        pos += len(line)
+    if not in_table:
+        end = m.start() + len(md[m.start():pos].rstrip())
+    return m.start(), end
+
+def splice_sections(md: str, patch_md: str, sections: list[str]) -> str:
+    """Replaces (or inserts) each section in md with the patch's version, if the patch's version is usable."""
+    for name in sections:
+        if section_failed(name, parse_markdown_table(patch_md, name)):
+            continue
+        ps, pe = section_span(patch_md, name)
+        block = patch_md[ps:pe]
+        span = section_span(md, name)
+        if span:
+            md = md[: span[0]] + block + md[span[1]:]
+        else:
+            anchor = section_span(md, "Evidence")
+            if anchor:
+                md = md[: anchor[0]] + block + "\n\n" + md[anchor[0]:]
+            else:
+                md = md.rstrip() + "\n\n" + block + "\n"
+    return md
+
+def repair_dashboard_md(md: str, context: str, budget: int = DASHBOARD_REPAIR_BUDGET) -> str:
+    """
+    Re-fetches only the failed KPI/Trend/Sectors/Mix tables (up to `budget` calls) and
+    splices them into md. Responses with no usable section at all are left alone.
+    """
+    for _ in range(max(budget, 0)):
+        failed = dashboard_section_failures(md)
+        if not failed or len(failed) == len(DASHBOARD_SECTIONS):
+            break
+        patch = call_agent_api(section_repair_prompt(context, failed))
+        md = splice_sections(md, patch, failed)
+    return md
+
+def build_dashboard_from_md(md: str):
+    if dashboard_section_failures(md, strict=False):
+        return None
+
+    kpi_df = parse_markdown_table(md, "KPI")
+    trend_df = parse_markdown_table(md, "Trend")
+    sectors_df = parse_markdown_table(md, "Sectors")
+    mix_df = parse_markdown_table(md, "Mix")
+
+    kpi_map = parse_kpi_map(kpi_df.rename(columns={c: c.strip() for c in kpi_df.columns}))
 
     tdf = trend_df.rename(columns={c: c.strip() for c in trend_df.columns})
     if "Commitments" in tdf.columns:
@@ -487,8 +766,239 @@ def build_dashboard_from_md(md: str):
     narrative = md.split("### KPI")[0].strip() if "### KPI" in md else md
     return {"kpis": kpi_map, "trend": tdf, "sectors": sdf, "mix": mdf, "narrative": narrative}
 
+# ---- Multi-country comparison (concurrent fan-out, cached slices) ----
+def get_cached_slice(context: str) -> str | None:
+    with SLICE_CACHE["lock"]:
+        hit = SLICE_CACHE["slices"].get(context)
+        if hit is None:
+            return None
+        stored_at, md = hit
+        if time.time() - stored_at > DASHBOARD_CACHE_TTL_S:
+            SLICE_CACHE["slices"].pop(context, None)
+            return None
+        return md
+
+def put_cached_slice(context: str, md: str) -> None:
+    with SLICE_CACHE["lock"]:
+        SLICE_CACHE["slices"][context] = (time.time(), md)
+
+def fetch_dashboard_md(context: str, use_cache: bool = True) -> str:
+    """
+    Fetch → targeted repair → cache, shared by the refresh button and the comparison fan-out.
+    use_cache=False forces a fresh KB call (the result still refreshes the cache).
+    Only slices that render from KB data are cached.
+    """
+    if use_cache:
+        cached = get_cached_slice(context)
+        if cached is not None:
+            return cached
+    md = repair_dashboard_md(call_agent_api(dashboard_prompt(context)), context)
+    if build_dashboard_from_md(md) is not None:
+        put_cached_slice(context, md)
+    return md
+
+def fetch_comparison_md(countries: list[str], years: str, sector: str) -> dict[str, str]:
+    """One dashboard request per country, issued concurrently (bounded by AGENT_LIMITER)."""
+    if not countries:
+        return {}
+    contexts = {c: build_context(c, years, sector) for c in countries}
+    with ThreadPoolExecutor(max_workers=len(contexts)) as pool:
+        futures = {c: pool.submit(fetch_dashboard_md, ctx) for c, ctx in contexts.items()}
+        return {c: f.result() for c, f in futures.items()}
+
+def build_comparison_frames(md_by_country: dict[str, str], years: str, sector: str) -> dict:
+    """
+    Merges per-country dashboards into shared frames:
+    kpis    -> one row per country
+    sectors -> Country × Sector long frame (render_heatmap shape), KB countries only
+    mix     -> Country × Type long frame (render_heatmap shape), KB countries only
+    Countries whose KB slice is missing fall back to DEMO values, are listed in "demo" and
+    go into "demo_sectors"/"demo_mix" — DEMO intensities are unitless, so they never share
+    a colour scale with KB USD values.
+    """
+    kpi_rows, demo = [], []
+    rows = {"sectors": [], "mix": [], "demo_sectors": [], "demo_mix": []}
+    for c, md in md_by_country.items():
+        parsed = build_dashboard_from_md(md.strip()) if md else None
+        if parsed is None:
+            demo.append(c)
+            kpis_map = make_demo_kpis(c, years, sector)
+            sdf = make_demo_heatmap_df(c, years, sector).groupby("Row", as_index=False)["Intensity"].mean()
+            sdf = sdf.rename(columns={"Row": "Sector", "Intensity": "Value"})
+            mdf = make_demo_type_heatmap_df(c, years, sector).groupby("Row", as_index=False)["Intensity"].mean()
+            mdf = mdf.rename(columns={"Row": "Type", "Intensity": "Value"})
+        else:
+            kpis_map, sdf, mdf = parsed["kpis"], parsed["sectors"], parsed["mix"]
+
+        kpi_rows.append({"Country": c, "Source": "DEMO" if parsed is None else "KB", **kpis_map})
+        prefix = "demo_" if parsed is None else ""
+        if {"Sector", "Value"}.issubset(set(sdf.columns)):
+            for _, row in sdf.dropna(subset=["Value"]).iterrows():
+                rows[prefix + "sectors"].append({"Row": c, "Column": str(row["Sector"]).strip(), "Intensity": row["Value"]})
+        if {"Type", "Value"}.issubset(set(mdf.columns)):
+            for _, row in mdf.dropna(subset=["Value"]).iterrows():
+                rows[prefix + "mix"].append({"Row": c, "Column": str(row["Type"]).strip(), "Intensity": row["Value"]})
+
+    frames = {k: pd.DataFrame(v, columns=["Row", "Column", "Intensity"]) for k, v in rows.items()}
+    return {"kpis": pd.DataFrame(kpi_rows), **frames, "demo": demo}
+
+# ---- Multi-turn context (token-budgeted; older turns compacted into a running summary) ----
+SUMMARY_LINE_CHARS = 240
+SUMMARY_GIST_WORDS = 8
+SUMMARY_MIN_GIST_WORDS = 2
+DEDUP_MIN_CHARS = 800
+EARLIER_PREFIX = "- Earlier: "
+TURN_LINE = re.compile(r"^-\s*(#\d+ (?:User|Agent):)\s*(.*)$")
+GIST = re.compile(r"^(#\d+ (?:User|Agent):)\s*(.*)$")
+RANGE_ENTRY = re.compile(r"^(#\d+–#\d+) \((.*)\)$")
+
+def is_dashboard_md(text: str) -> bool:
+    return sum(1 for name in DASHBOARD_SECTIONS if parse_markdown_table(text, name) is not None) >= 2
+
+def compact_turn(m: dict, pos: int) -> str:
+    """One summary line per turn ("- #pos Role: text"): tables dropped, whitespace collapsed, truncated."""
+    text = m["content"]
+    if is_dashboard_md(text):
+        text = "[dashboard tables omitted] " + text.split("### KPI")[0]
+    text = " ".join(line for line in text.splitlines() if not line.strip().startswith("|"))
+    text = re.sub(r"\s+", " ", text).strip()
+    return f"- #{pos} {'User' if m['role'] == 'user' else 'Agent'}: {shorten(text, SUMMARY_LINE_CHARS)}"
+
+def shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+def gist(label: str, text: str, words: int) -> str:
+    kept = text.replace(";", ",").rstrip("…").split()
+    tail = "…" if len(kept) > words else ""
+    return f"{label} {' '.join(kept[:words])}{tail}".rstrip()
+
+def earlier_parts(line: str) -> list[tuple[str, str]]:
+    """
+    (label, text) for each entry on an "Earlier:" line. Turn gists have labels like
+    "#5 User:"; folded ranges have labels like "#2–#40" and text "39 turns · user topics: …".
+    """
+    out = []
+    for part in line.removeprefix(EARLIER_PREFIX).split("; "):
+        part = part.strip()
+        m = RANGE_ENTRY.match(part) or GIST.match(part)
+        out.append((m.group(1), m.group(2)) if m else ("", part))
+    return out
+
+def format_part(label: str, text: str, words: int) -> str:
+    return f"{label} ({text})" if "–" in label else gist(label, text, words)
+
+def fold_parts(parts: list[tuple[str, str]]) -> tuple[str, str]:
+    """Folds consecutive entries (gists or ranges) into one bounded range entry."""
+    nums, count, topics = [], 0, []
+    for label, text in parts:
+        nums += re.findall(r"#\d+", label)
+        if "–" in label:
+            m = re.match(r"(\d+) turns · user topics: (.*)$", text)
+            count += int(m.group(1)) if m else 1
+            if m and m.group(2):
+                topics.append(m.group(2).rstrip("…"))
+        else:
+            count += 1
+            if label.endswith("User:") and text:
+                topics.append(" ".join(text.replace(";", ",").rstrip("…").split()[:SUMMARY_MIN_GIST_WORDS]))
+    span = f"{nums[0]}–{nums[-1]}" if nums else "#?–#?"
+    return span, f"{count} turns · user topics: {shorten(', '.join(topics), SUMMARY_LINE_CHARS)}"
+
+def fit_summary(lines: list[str]) -> list[str]:
+    """
+    Squeezes summary lines into SUMMARY_TOKEN_BUDGET while every turn stays represented.
+    The first line (the topic-setting first turn) is kept as is. Full turn lines are
+    compacted oldest-first into new "Earlier:" lines of short per-turn gists; existing
+    "Earlier:" lines are only merged (oldest two at a time, gists halved down to
+    SUMMARY_MIN_GIST_WORDS) once no full lines are left. As a last resort, agent gists
+    collapse to their turn labels and the oldest entries fold into one "#a–#b" range entry.
+    """
+    def over(ls: list[str]) -> bool:
+        return estimate_tokens("\n".join(ls)) > SUMMARY_TOKEN_BUDGET
+
+    head, rest = lines[:1], lines[1:]
+    earlier = [line for line in rest if line.startswith(EARLIER_PREFIX)]
+    full = [line for line in rest if not line.startswith(EARLIER_PREFIX)]
+
+    while over(head + earlier + full) and full:
+        batch, full = full[:2], full[2:]
+        gists = []
+        for line in batch:
+            m = TURN_LINE.match(line)
+            label, text = (m.group(1), m.group(2)) if m else ("", line.removeprefix("- "))
+            gists.append(gist(label, text, SUMMARY_GIST_WORDS))
+        earlier.append(EARLIER_PREFIX + "; ".join(gists))
+
+    while over(head + earlier) and len(earlier) > 1:
+        parts = earlier_parts(earlier[0]) + earlier_parts(earlier[1])
+        halved = [format_part(label, text, max(len(text.split()) // 2, SUMMARY_MIN_GIST_WORDS)) for label, text in parts]
+        earlier = [EARLIER_PREFIX + "; ".join(halved)] + earlier[2:]
+
+    if over(head + earlier) and earlier:
+        parts = [(label, "" if label.endswith("Agent:") else text) for label, text in earlier_parts(earlier[0])]
+        earlier = [EARLIER_PREFIX + "; ".join(format_part(label, text, SUMMARY_MIN_GIST_WORDS) for label, text in parts)]
+        for k in range(2, len(parts) + 1):
+            if not over(head + earlier):
+                break
+            entries = [fold_parts(parts[:k])] + parts[k:]
+            earlier = [EARLIER_PREFIX + "; ".join(format_part(label, text, SUMMARY_MIN_GIST_WORDS) for label, text in entries)]
+    return head + earlier + full
+
+def dedupe_turns(turns: list[dict]) -> list[dict]:
+    """Keeps only the newest copy of repeated long content and of dashboard markdown."""
+    seen, out, newest_dashboard = set(), [], True
+    for m in reversed(turns):
+        content = m["content"]
+        if is_dashboard_md(content):
+            if not newest_dashboard:
+                content = "[Earlier dashboard — tables omitted]\n" + content.split("### KPI")[0].strip()
+            newest_dashboard = False
+        elif len(content) >= DEDUP_MIN_CHARS:
+            digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+            if digest in seen:
+                content = "[Repeated content omitted — identical to a later turn.]"
+            seen.add(digest)
+        out.append({"role": m["role"], "content": content})
+    return list(reversed(out))
+
+def build_chat_history(session_id: str, message: str) -> list[dict]:
+    """
+    Prior turns for a multi-turn request, within CONTEXT_TOKEN_BUDGET:
+    newest turns verbatim, older ones folded into a running summary (persisted in STORE,
+    extended only with turns that have aged out since the last request).
+    Position 0 is the seeded greeting and is never sent.
+    """
+    total = STORE.message_count(session_id)
+    summary = STORE.get_value(session_id, "ctx_summary")
+    summarized_upto = int(STORE.get_value(session_id, "ctx_summarized_upto") or "1")
+
+    budget = CONTEXT_TOKEN_BUDGET - estimate_tokens(message) - SUMMARY_TOKEN_BUDGET
+    start = max(summarized_upto, 1)
+    tail = dedupe_turns(STORE.messages_range(session_id, start, total))
+    kept, used = [], 0
+    for m in reversed(tail):
+        cost = estimate_tokens(m["content"])
+        if used + cost > budget:
+            break
+        kept.append(m)
+        used += cost
+    kept.reverse()
+
+    cutoff = total - len(kept)
+    if cutoff > start:
+        lines = summary.splitlines() if summary else []
+        lines += [compact_turn(m, start + i) for i, m in enumerate(STORE.messages_range(session_id, start, cutoff))]
+        summary = "\n".join(fit_summary(lines))
+        STORE.set_value(session_id, "ctx_summary", summary)
+        STORE.set_value(session_id, "ctx_summarized_upto", str(cutoff))
+
+    history = []
+    if summary:
+        history.append({"role": "system", "content": "Summary of earlier conversation:\n" + summary})
+    return history + kept
+
 def fmt_money(v: float | None) -> str:
-    if v is None:
+    if v is None or pd.isna(v):
         return "—"
     if v >= 1e9:
         return f"${v/1e9:.2f}B"
@@ -503,7 +1013,7 @@ def fmt_int(v) -> str:
         return "—"
 
 def fmt_pct(v: float | None) -> str:
-    if v is None:
+    if v is None or pd.isna(v):
         return "—"
     return f"{v:.1f}%"
 
@@ -514,9 +1024,16 @@ def fmt_pct(v: float | None) -> str:
 with st.sidebar:
     st.markdown("<div class='wb-side'>", unsafe_allow_html=True)
     st.markdown("### Filters")
-    country = st.selectbox("Country", ["Global", "KEN", "NGA", "IND", "BRA", "PHL", "IDN", "EGY", "PAK", "ETH"], index=1)
+    COUNTRIES = ["Global", "KEN", "NGA", "IND", "BRA", "PHL", "IDN", "EGY", "PAK", "ETH"]
+    country = st.selectbox("Country", COUNTRIES, index=1)
     years = st.selectbox("Year range", ["2020-2023", "2021-2024", "2022-2025"], index=1)
     sector = st.selectbox("Sector", ["All", "Health", "Education", "Energy", "Transport", "Water", "Governance", "Agriculture"], index=0)
+    compare_countries = st.multiselect(
+        "Compare countries",
+        [c for c in COUNTRIES if c != "Global"],
+        default=[],
+        help="Pick 2+ countries to fan out one dashboard request each (concurrently) and compare side by side.",
+    )
 
     st.divider()
     st.markdown("### Quick Actions (KB-aware)")
@@ -562,24 +1079,43 @@ with st.sidebar:
 # Session State
 # ============================================================
 
-if "messages" not in st.session_state:
-    st.session_state.messages = [
-        {
-            "role": "assistant",
-            "content": (
-                "Hi — I’m the **World Bank IATI Intelligence Agent**.\n\n"
-                "Use the dashboard to explore the portfolio, then ask questions in chat.\n"
-                "I’ll cite evidence when available in the KB.\n\n"
-                "Tip: Click **Refresh dashboard** to pull KPI + chart data for your selected filters."
-            ),
-        }
-    ]
+# Only lightweight handles live here; messages + dashboard state are in STORE.
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+if "history_window" not in st.session_state:
+    st.session_state["history_window"] = CHAT_RENDER_WINDOW
 if "draft_prompt" not in st.session_state:
     st.session_state["draft_prompt"] = ""
-if "dash_md" not in st.session_state:
-    st.session_state["dash_md"] = ""
-if "last_response" not in st.session_state:
-    st.session_state["last_response"] = ""
+
+SESSION_ID = st.session_state["session_id"]
+STORE.evict_idle(SESSION_IDLE_TTL_S)
+STORE.touch(SESSION_ID)
+
+if STORE.message_count(SESSION_ID) == 0:
+    STORE.append_message(
+        SESSION_ID,
+        "assistant",
+        (
+            "Hi — I’m the **World Bank IATI Intelligence Agent**.\n\n"
+            "Use the dashboard to explore the portfolio, then ask questions in chat.\n"
+            "I’ll cite evidence when available in the KB.\n\n"
+            "Tip: Click **Refresh dashboard** to pull KPI + chart data for your selected filters."
+        ),
+    )
+
+with st.sidebar:
+    st.markdown("<div class='wb-side'>", unsafe_allow_html=True)
+    st.markdown("### Session")
+    handle_bytes = sum(len(str(v).encode("utf-8")) for v in st.session_state.to_dict().values())
+    st.caption(f"Messages: `{STORE.message_count(SESSION_ID)}`")
+    st.caption(f"Stored state: `{STORE.session_bytes(SESSION_ID) / 1024:.1f} KB`")
+    st.caption(f"In-memory handles: `{handle_bytes} B`")
+    multi_turn = st.toggle(
+        "Multi-turn context",
+        value=True,
+        help=f"Send recent turns (plus a compact summary of older ones) within ~{CONTEXT_TOKEN_BUDGET} tokens.",
+    )
+    st.markdown("</div>", unsafe_allow_html=True)
 
 # ============================================================
 # Dashboard
@@ -595,10 +1131,10 @@ with top_right:
 
 if refresh:
     with st.spinner("Refreshing dashboard from KB…"):
-        md = call_agent_api(dashboard_prompt(context))
-    st.session_state["dash_md"] = md
+        md = fetch_dashboard_md(context, use_cache=False)
+    STORE.set_value(SESSION_ID, "dash_md", md)
 
-dash_md = st.session_state.get("dash_md", "").strip()
+dash_md = STORE.get_value(SESSION_ID, "dash_md").strip()
 kb_parsed = build_dashboard_from_md(dash_md) if dash_md else None
 is_demo = kb_parsed is None
 
@@ -621,6 +1157,12 @@ if is_demo:
         "Heatmaps below are placeholder values generated for UX/demo purposes (with legend).</div>",
         unsafe_allow_html=True,
     )
+    if dash_md:
+        missing = dashboard_section_failures(dash_md, strict=False)
+        incomplete = [s for s in dashboard_section_failures(dash_md) if s not in missing]
+        st.caption("Missing or NA KB sections: " + ", ".join(missing))
+        if incomplete:
+            st.caption("Also incomplete (blank or unconvertible cells): " + ", ".join(incomplete))
 
 # KPI cards
 kpi_cols = st.columns(4, gap="large")
@@ -690,6 +1232,69 @@ with c4:
     st.markdown(f"<div class='narrative-small'>{narrative}</div>", unsafe_allow_html=True)
     st.caption(context)
 
+# ============================================================
+# Country Comparison
+# ============================================================
+
+if len(compare_countries) >= 2:
+    st.divider()
+    cmp_left, cmp_right = st.columns([2.1, 1.0], gap="large")
+    with cmp_left:
+        st.subheader("Country Comparison")
+    with cmp_right:
+        run_compare = st.button("🌐 Compare countries", type="primary", use_container_width=True)
+
+    compare_key = [list(compare_countries), years, sector]
+    if run_compare:
+        with st.spinner(f"Fetching {len(compare_countries)} dashboards in parallel…"):
+            slices = fetch_comparison_md(compare_countries, years, sector)
+        STORE.set_value(SESSION_ID, "compare", json.dumps({"key": compare_key, "slices": slices}))
+
+    compare_state = json.loads(STORE.get_value(SESSION_ID, "compare") or '{"key": null, "slices": {}}')
+    if compare_state["key"] != compare_key:
+        st.info("Click **Compare countries** to fetch dashboards for the selected countries.")
+    else:
+        frames = build_comparison_frames(compare_state["slices"], years, sector)
+        if frames["demo"]:
+            st.markdown(
+                "<div class='demo'><b>DEMO DATA</b> — KB slice missing for: "
+                + ", ".join(frames["demo"])
+                + ". Their KPIs are placeholders and they are excluded from the KB heatmaps "
+                "(shown separately below).</div>",
+                unsafe_allow_html=True,
+            )
+
+        cmp_cols = st.columns(len(compare_countries), gap="small")
+        for col, row in zip(cmp_cols, frames["kpis"].to_dict("records")):
+            with col:
+                st.markdown(
+                    f"<div class='kpi'><div class='kpi-label'>{row['Country']} · {row['Source']}</div>"
+                    f"<div class='kpi-value'>{fmt_money(row.get('Commitments'))}</div>"
+                    f"<div class='kpi-note'>Disbursed {fmt_money(row.get('Disbursements'))}<br>"
+                    f"{fmt_int(row.get('Projects'))} projects · {fmt_pct(row.get('Disbursement Ratio %'))}</div></div>",
+                    unsafe_allow_html=True,
+                )
+
+        h1, h2 = st.columns([1.0, 1.0], gap="large")
+        with h1:
+            if frames["sectors"].empty:
+                st.info("Sector data not available.")
+            else:
+                render_heatmap(frames["sectors"], "Sector Value by Country × Sector", row_title="Country", col_title="Sector")
+        with h2:
+            if frames["mix"].empty:
+                st.info("Mix data not available.")
+            else:
+                render_heatmap(frames["mix"], "Modality Value by Country × Type", row_title="Country", col_title="Type")
+
+        if frames["demo"]:
+            st.markdown("#### Placeholder Heatmaps — DEMO")
+            d1, d2 = st.columns([1.0, 1.0], gap="large")
+            with d1:
+                render_heatmap(frames["demo_sectors"], "Sector Intensity by Country × Sector — DEMO", row_title="Country", col_title="Sector")
+            with d2:
+                render_heatmap(frames["demo_mix"], "Modality Intensity by Country × Type — DEMO", row_title="Country", col_title="Type")
+
 st.divider()
 
 # ============================================================
@@ -698,7 +1303,15 @@ st.divider()
 
 st.subheader("Ask the Agent")
 
-for m in st.session_state.messages:
+total_messages = STORE.message_count(SESSION_ID)
+window = st.session_state["history_window"]
+if total_messages > window:
+    hidden = total_messages - window
+    if st.button(f"⬆ Load earlier messages ({hidden} hidden)"):
+        st.session_state["history_window"] = window + CHAT_RENDER_WINDOW
+        st.rerun()
+
+for m in STORE.recent_messages(SESSION_ID, window):
     with st.chat_message("assistant" if m["role"] == "assistant" else "user"):
         st.markdown(m["content"])
 
@@ -729,24 +1342,28 @@ elif user_input:
 
 if outgoing:
     msg = f"{context}\n\nUser request: {outgoing}"
+    history = build_chat_history(SESSION_ID, msg) if multi_turn else []
 
-    st.session_state.messages.append({"role": "user", "content": outgoing})
+    STORE.append_message(SESSION_ID, "user", outgoing)
     with st.chat_message("user"):
         st.markdown(outgoing)
 
     with st.chat_message("assistant"):
         with st.spinner("Thinking with KB…"):
-            reply = call_agent_api(msg)
+            reply = call_agent_api(msg, history)
         st.markdown(reply)
+        if multi_turn:
+            ctx_tokens = sum(estimate_tokens(m["content"]) for m in history) + estimate_tokens(msg)
+            st.caption(f"Context: {len(history)} prior message(s) · ~{ctx_tokens} tokens")
 
-    st.session_state.messages.append({"role": "assistant", "content": reply})
-    st.session_state["last_response"] = reply
+    STORE.append_message(SESSION_ID, "assistant", reply)
+    STORE.set_value(SESSION_ID, "last_response", reply)
 
 # Export last chat response: KEEP download button ONLY
 st.markdown("### Export Last Chat Response")
 st.download_button(
     label="Download Last Response (.md)",
-    data=(st.session_state.get("last_response") or ""),
+    data=STORE.get_value(SESSION_ID, "last_response"),
     file_name="agent_response.md",
     mime="text/markdown",
     use_container_width=True,
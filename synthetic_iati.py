@@ -0,0 +1,274 @@
+import argparse
+import csv
+import hashlib
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+
+
+# ============================================================
+# Synthetic IATI dataset generator (performance testing)
+# Deterministic: same seed + options => byte-identical output
+# Streams activities in chunks (constant memory at any scale)
+# Writes IATI 2.03 activity XML and/or flat CSV (activities + transactions)
+#
+#   python synthetic_iati.py --activities 100000 --scale 10 --format both --out data/10x
+# ============================================================
+
+IATI_VERSION = "2.03"
+REPORTING_ORG_REF = "44000"  # World Bank (OECD DAC code)
+REPORTING_ORG_NAME = "World Bank"
+
+# App country codes (ISO3) -> IATI recipient-country codes (ISO 3166-1 alpha-2)
+COUNTRIES = {
+    "KEN": ("KE", "Kenya"),
+    "NGA": ("NG", "Nigeria"),
+    "IND": ("IN", "India"),
+    "BRA": ("BR", "Brazil"),
+    "PHL": ("PH", "Philippines"),
+    "IDN": ("ID", "Indonesia"),
+    "EGY": ("EG", "Egypt"),
+    "PAK": ("PK", "Pakistan"),
+    "ETH": ("ET", "Ethiopia"),
+}
+
+# App sector names -> OECD DAC 5-digit purpose codes (sector vocabulary 1)
+SECTORS = {
+    "Health": "12220",
+    "Education": "11220",
+    "Energy": "23110",
+    "Transport": "21010",
+    "Water": "14020",
+    "Governance": "15110",
+    "Agriculture": "31120",
+}
+
+# IATI AidType codes (vocabulary 1)
+AID_TYPES = {
+    "C01": "Project-type interventions",
+    "D02": "Other technical assistance",
+    "A02": "Sector budget support",
+    "B03": "Contributions to pooled programmes and funds",
+}
+
+# IATI ActivityStatus codes: 2=Implementation, 3=Finalisation, 4=Closed
+ACTIVITY_STATUSES = {"2": 6, "3": 1, "4": 3}
+
+ACTIVITY_FIELDS = [
+    "iati_identifier", "reporting_org", "title", "recipient_country", "sector_code", "sector_name",
+    "aid_type", "activity_status", "start_date", "end_date", "currency", "total_commitment",
+]
+TRANSACTION_FIELDS = ["iati_identifier", "transaction_type", "transaction_date", "value", "currency"]
+
+
+def seeded_rng(*parts: str) -> random.Random:
+    # Same derivation as app.seeded_rng (app.py only imports under `streamlit run`).
+    key = "|".join(parts)
+    h = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    seed = int(h[:12], 16)
+    return random.Random(seed)
+
+def parse_weights(spec: str, known: dict, label: str) -> tuple[list[str], list[float]]:
+    """'KEN=3,NGA=2,ETH' -> (["KEN", "NGA", "ETH"], cumulative weights). Bare keys weigh 1."""
+    keys, cum, total = [], [], 0.0
+    for part in (p.strip() for p in spec.split(",")):
+        if not part:
+            continue
+        key, _, weight = part.partition("=")
+        key = key.strip()
+        if key not in known:
+            raise SystemExit(f"Unknown {label} '{key}'. Choose from: {', '.join(known)}")
+        try:
+            w = float(weight) if weight else 1.0
+        except ValueError:
+            raise SystemExit(f"Invalid weight '{weight}' for {label} '{key}' (expected a number, e.g. {key}=2).") from None
+        if w <= 0:
+            continue
+        total += w
+        keys.append(key)
+        cum.append(total)
+    if not keys:
+        raise SystemExit(f"No {label} with positive weight in '{spec}'.")
+    return keys, cum
+
+def make_activity(rng: random.Random, seq: int, opts: dict) -> tuple[dict, list[dict]]:
+    country = rng.choices(opts["countries"][0], cum_weights=opts["countries"][1])[0]
+    sector = rng.choices(opts["sectors"][0], cum_weights=opts["sectors"][1])[0]
+    aid_type = rng.choices(opts["aid_types"][0], cum_weights=opts["aid_types"][1])[0]
+    status = rng.choices(opts["statuses"][0], cum_weights=opts["statuses"][1])[0]
+
+    start = opts["first_day"] + timedelta(days=rng.randrange(opts["span_days"]))
+    end = start + timedelta(days=rng.randint(365, 6 * 365))
+    commitment = round(rng.lognormvariate(opts["value_mu"], opts["value_sigma"]), 2)
+
+    iid = f"{REPORTING_ORG_REF}-SYN{seq:010d}"
+    iso2, country_name = COUNTRIES[country]
+    activity = {
+        "iati_identifier": iid,
+        "reporting_org": REPORTING_ORG_REF,
+        "title": f"{sector} programme in {country_name} #{seq}",
+        "recipient_country": iso2,
+        "sector_code": SECTORS[sector],
+        "sector_name": sector,
+        "aid_type": aid_type,
+        "activity_status": status,
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "currency": "USD",
+        "total_commitment": f"{commitment:.2f}",
+    }
+
+    # One commitment (type 2), then disbursements (type 3) that never exceed it.
+    # Transactions are never dated after the stamp date (IATI rejects future-dated transactions).
+    n_tx = rng.randint(0, 2 * opts["tx_mean"]) if opts["tx_mean"] > 0 else 0
+    transactions = []
+    if n_tx:
+        transactions.append(
+            {"iati_identifier": iid, "transaction_type": "2", "transaction_date": start.isoformat(),
+             "value": f"{commitment:.2f}", "currency": "USD"}
+        )
+        remaining = commitment
+        span = max((min(end, opts["last_day"]) - start).days, 1)
+        offsets = sorted(rng.randrange(span) for _ in range(n_tx - 1))
+        for off in offsets:
+            value = round(remaining * rng.uniform(0.05, 0.35), 2)
+            remaining -= value
+            transactions.append(
+                {"iati_identifier": iid, "transaction_type": "3",
+                 "transaction_date": (start + timedelta(days=off)).isoformat(),
+                 "value": f"{value:.2f}", "currency": "USD"}
+            )
+    return activity, transactions
+
+def activity_xml(a: dict, transactions: list[dict], stamp: str) -> str:
+    parts = [
+        f'  <iati-activity last-updated-datetime="{stamp}" default-currency="{a["currency"]}" xml:lang="en">\n',
+        f'    <iati-identifier>{escape(a["iati_identifier"])}</iati-identifier>\n',
+        f'    <reporting-org ref="{a["reporting_org"]}" type="40"><narrative>{REPORTING_ORG_NAME}</narrative></reporting-org>\n',
+        f'    <title><narrative>{escape(a["title"])}</narrative></title>\n',
+        '    <description type="1"><narrative>Synthetic activity generated for performance testing.</narrative></description>\n',
+        f'    <participating-org ref="{a["reporting_org"]}" role="1" type="40"><narrative>{REPORTING_ORG_NAME}</narrative></participating-org>\n',
+        f'    <activity-status code="{a["activity_status"]}"/>\n',
+        f'    <activity-date type="2" iso-date="{a["start_date"]}"/>\n',
+        f'    <activity-date type="3" iso-date="{a["end_date"]}"/>\n',
+        f'    <recipient-country code="{a["recipient_country"]}" percentage="100"/>\n',
+        f'    <sector vocabulary="1" code="{a["sector_code"]}" percentage="100"/>\n',
+        f'    <default-aid-type code="{a["aid_type"]}" vocabulary="1"/>\n',
+    ]
+    for t in transactions:
+        parts.append(
+            "    <transaction>"
+            f'<transaction-type code="{t["transaction_type"]}"/>'
+            f'<transaction-date iso-date="{t["transaction_date"]}"/>'
+            f'<value currency="{t["currency"]}" value-date="{t["transaction_date"]}">{t["value"]}</value>'
+            "</transaction>\n"
+        )
+    parts.append("  </iati-activity>\n")
+    return "".join(parts)
+
+def generate(args: argparse.Namespace) -> dict:
+    total = int(args.activities * args.scale)
+    first_day = date(args.start_year, 1, 1)
+    last_day = date(args.end_year, 12, 31)
+    opts = {
+        "countries": parse_weights(args.countries, COUNTRIES, "country"),
+        "sectors": parse_weights(args.sectors, SECTORS, "sector"),
+        "aid_types": parse_weights(args.aid_types, AID_TYPES, "aid type"),
+        "statuses": parse_weights(",".join(f"{k}={v}" for k, v in ACTIVITY_STATUSES.items()), ACTIVITY_STATUSES, "status"),
+        "first_day": first_day,
+        "last_day": last_day,
+        "span_days": (last_day - first_day).days + 1,
+        "tx_mean": args.transactions,
+        "value_mu": args.value_mu,
+        "value_sigma": args.value_sigma,
+    }
+    # Fixed stamp keeps output reproducible across runs.
+    stamp = f"{last_day.isoformat()}T00:00:00Z"
+    rng = seeded_rng(str(args.seed), "activities")
+    os.makedirs(args.out, exist_ok=True)
+
+    want_xml = args.format in ("xml", "both")
+    want_csv = args.format in ("csv", "both")
+    xml_f = open(os.path.join(args.out, "activities.xml"), "w", encoding="utf-8") if want_xml else None
+    act_f = open(os.path.join(args.out, "activities.csv"), "w", encoding="utf-8", newline="") if want_csv else None
+    tx_f = open(os.path.join(args.out, "transactions.csv"), "w", encoding="utf-8", newline="") if want_csv else None
+
+    n_tx = 0
+    t0 = time.perf_counter()
+    try:
+        if xml_f:
+            xml_f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            xml_f.write(f'<iati-activities version="{IATI_VERSION}" generated-datetime="{stamp}">\n')
+        if act_f:
+            act_w = csv.DictWriter(act_f, fieldnames=ACTIVITY_FIELDS)
+            tx_w = csv.DictWriter(tx_f, fieldnames=TRANSACTION_FIELDS)
+            act_w.writeheader()
+            tx_w.writeheader()
+
+        for chunk_start in range(0, total, args.chunk_size):
+            xml_buf, act_rows, tx_rows = [], [], []
+            for seq in range(chunk_start, min(chunk_start + args.chunk_size, total)):
+                activity, transactions = make_activity(rng, seq, opts)
+                n_tx += len(transactions)
+                if xml_f:
+                    xml_buf.append(activity_xml(activity, transactions, stamp))
+                if act_f:
+                    act_rows.append(activity)
+                    tx_rows.extend(transactions)
+            if xml_f:
+                xml_f.write("".join(xml_buf))
+            if act_f:
+                act_w.writerows(act_rows)
+                tx_w.writerows(tx_rows)
+            if not args.quiet:
+                done = min(chunk_start + args.chunk_size, total)
+                print(f"  {done:,}/{total:,} activities, {n_tx:,} transactions", file=sys.stderr)
+
+        if xml_f:
+            xml_f.write("</iati-activities>\n")
+    finally:
+        for f in (xml_f, act_f, tx_f):
+            if f:
+                f.close()
+
+    return {"activities": total, "transactions": n_tx, "seconds": time.perf_counter() - t0}
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Generate a deterministic synthetic IATI dataset for performance testing.")
+    p.add_argument("--activities", type=int, default=100_000, help="Base (1x) number of activities.")
+    p.add_argument("--scale", type=float, default=1.0, help="Multiplier on --activities (e.g. 10, 100).")
+    p.add_argument("--transactions", type=int, default=6, help="Mean transactions per activity.")
+    p.add_argument("--seed", default="iati", help="Seed string; same seed => identical output.")
+    p.add_argument("--countries", default=",".join(COUNTRIES), help="Weighted countries, e.g. KEN=3,NGA=2,ETH.")
+    p.add_argument("--sectors", default=",".join(SECTORS), help="Weighted sectors, e.g. Health=2,Energy.")
+    p.add_argument("--aid-types", default="C01=5,D02=2,A02=1,B03=1", help="Weighted IATI aid type codes.")
+    p.add_argument("--start-year", type=int, default=2020)
+    p.add_argument("--end-year", type=int, default=2025)
+    p.add_argument("--value-mu", type=float, default=16.0, help="Log-mean of commitment value (USD).")
+    p.add_argument("--value-sigma", type=float, default=1.2, help="Log-sd of commitment value.")
+    p.add_argument("--format", choices=["xml", "csv", "both"], default="both")
+    p.add_argument("--chunk-size", type=int, default=5_000, help="Activities buffered per write.")
+    p.add_argument("--out", default="synthetic_iati_out")
+    p.add_argument("--quiet", action="store_true")
+    return p
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.end_year < args.start_year:
+        args.start_year, args.end_year = args.end_year, args.start_year
+    if args.chunk_size < 1:
+        raise SystemExit("--chunk-size must be >= 1")
+    stats = generate(args)
+    rate = stats["activities"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(
+        f"Wrote {stats['activities']:,} activities / {stats['transactions']:,} transactions "
+        f"to {args.out} in {stats['seconds']:.1f}s ({rate:,.0f} activities/s)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())